@@ -15,16 +15,30 @@ import argparse
 import struct
 import binascii
 import uuid
-import copy
 import datetime
+import time
 import pyewf
 import pyvmdk
-import io
+import mmap
+from array import array
 from ctypes import *
-from calendar import timegm
 
 __VERSION__ = '20200306'
 vss_identifier = b'\x6B\x87\x08\x38\x76\xC1\x48\x4E\xB7\xAE\x04\x04\x6E\x6C\xC7\x52'
+STORE_BLOCK_SIZE = 0x4000
+STORE_BLOCK_HEADER_SIZE = 128
+STORE_BLOCK_NEXT_OFFSET = 0x28  # StoreBlockHeader.next_block_offset
+UINT64 = struct.Struct('<Q')
+CATALOG_BLOCK_SIZE = 0x4000
+CATALOG_ENTRY_SIZE = 128
+CATALOG_BLOCK_COUNT = 4
+CARVE_CHUNK_SIZE = 16 * 1024 * 1024
+STORE_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+STORE_PREALLOCATION_SIZE = 64 * 1024 * 1024
+FALLOC_FL_KEEP_SIZE = 0x1
+FILETIME_PER_HOUR = 10000000 * 60 * 60
+STORE_CHUNK_KEYS = ('header', 'block', 'range', 'cur_bitmap', 'prev_bitmap')
+STORE_OFFSET_FIELDS = ('store_header_offset', 'store_block_list_offset', 'store_block_range_offset', 'store_current_bitmap_offset', 'store_previous_bitmap_offset')
 
 
 class VolumeHeader(LittleEndianStructure):
@@ -157,51 +171,229 @@ class StoreBlockHeader(LittleEndianStructure):
         self.next_block_offset = 0x0
         self.size_info = 0x0
         self.unknown = b'\x00'
-        self.flag_dummy = False
-
-
-class StoreBlockHeader0x4000(LittleEndianStructure):
-    _fields_ = (
-        ('vssid', c_char * 16),
-        ('version', c_uint32),
-        ('record_type', c_uint32),
-        ('relative_block_offset', c_uint64),
-        ('current_block_offset', c_uint64),
-        ('next_block_offset', c_uint64),
-        ('size_info', c_uint64),
-        ('unknown', c_char * 72),
-        ('data', c_char * (0x4000 - 128))
-    )
-
-    def __init__(self):
-        self.unknown = b'\x00'
-        self.data = b'\x00'
 
 
 class StoreBlockChunk(object):
     def __init__(self, store_block):
         # type: (StoreBlockHeader) -> None
-        self.head = copy.deepcopy(store_block)
-        self.list_next_block_offset = []
-        self.list_next_block_offset.append(store_block.next_block_offset)
+        self.head = clone_ctypes_struct(store_block)
+        # Chains can be thousands of blocks long, so keep them as packed unsigned 64-bit offsets.
+        self.list_next_block_offset = array('Q', [store_block.next_block_offset])
+
+
+class BufferedStoreFile(object):
+    # Collects store blocks in a preallocated buffer and writes them out in STORE_WRITE_BUFFER_SIZE batches.
+    def __init__(self, store_file, buffer_size=STORE_WRITE_BUFFER_SIZE):
+        self.f_store = open(store_file, "wb")
+        fadvise_sequential(self.f_store)
+        self.buffer = bytearray(buffer_size)
+        self.buffer_view = memoryview(self.buffer)
+        self.buffer_qword_view = self.buffer_view.cast('Q')
+        self.buffer_offset = 0
+        self.dict_store_block_view = {}
+        self.store_file_size = 0
+        self.preallocated_size = 0
+        self.fallocate = get_fallocate()
+
+    def reserve_store_block(self):
+        # Returns a view of the next STORE_BLOCK_SIZE bytes of the buffer so that a block can be built in place.
+        # The view is created once per buffer position and reused after every flush.
+        if self.buffer_offset + STORE_BLOCK_SIZE > len(self.buffer):
+            self.flush()
+        store_block_view = self.dict_store_block_view.get(self.buffer_offset)
+        if store_block_view is None:
+            store_block_view = self.buffer_view[self.buffer_offset:self.buffer_offset + STORE_BLOCK_SIZE]
+            self.dict_store_block_view[self.buffer_offset] = store_block_view
+        self.buffer_offset = self.buffer_offset + STORE_BLOCK_SIZE
+        return store_block_view
+
+    def preallocate(self, size):
+        # Reserves disk space ahead of the writes in STORE_PREALLOCATION_SIZE steps so that the store gets large contiguous extents.
+        # FALLOC_FL_KEEP_SIZE leaves the file size alone while writing. Blocks reserved past the end are given back in close().
+        if self.fallocate is None or size <= self.preallocated_size:
+            return
+        preallocation_size = max(size, self.preallocated_size + STORE_PREALLOCATION_SIZE)
+        if self.fallocate(self.f_store.fileno(), FALLOC_FL_KEEP_SIZE, self.preallocated_size, preallocation_size - self.preallocated_size) != 0:
+            # EOPNOTSUPP etc. The filesystem cannot reserve space without writing it.
+            self.fallocate = None
+            return
+        self.preallocated_size = preallocation_size
+
+    def flush(self):
+        # The relative and current offsets of a store block are its own offset in the store file.
+        # Set them for all blocks in the buffer at once through strided 64-bit views instead of one block at a time.
+        block_count = self.buffer_offset // STORE_BLOCK_SIZE
+        if block_count > 0:
+            list_store_block_offset = array('Q', range(self.store_file_size, self.store_file_size + block_count * STORE_BLOCK_SIZE, STORE_BLOCK_SIZE))
+            if sys.byteorder != 'little':
+                list_store_block_offset.byteswap()
+            qwords_per_block = STORE_BLOCK_SIZE // 8
+            for field_offset in (StoreBlockHeader.relative_block_offset.offset, StoreBlockHeader.current_block_offset.offset):
+                self.buffer_qword_view[field_offset // 8:block_count * qwords_per_block:qwords_per_block] = list_store_block_offset
+
+        self.preallocate(self.store_file_size + self.buffer_offset)
+        self.f_store.write(self.buffer_view[:self.buffer_offset])
+        self.store_file_size = self.store_file_size + self.buffer_offset
+        self.buffer_offset = 0
+
+    def close(self):
+        self.flush()
+        if self.preallocated_size > self.store_file_size:
+            self.f_store.flush()
+            os.ftruncate(self.f_store.fileno(), self.store_file_size)
+        self.f_store.close()
+
+
+def clone_ctypes_struct(struct_obj):
+    # Copies the raw bytes and python attributes without going through copy.deepcopy().
+    clone = type(struct_obj).from_buffer_copy(struct_obj)
+    clone.__dict__.update(struct_obj.__dict__)
+    return clone
+
+
+def get_fallocate():
+    # Returns Linux fallocate(2) from libc, or None elsewhere.
+    # os.posix_fallocate() is not used because glibc emulates it by writing zeros over the whole range when the filesystem has no fallocate support.
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        # fallocate64 takes 64-bit offsets on 32-bit glibc as well.
+        fallocate = CDLL(None, use_errno=True).fallocate64
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = (c_int, c_int, c_int64, c_int64)
+    fallocate.restype = c_int
+    return fallocate
+
+
+def fadvise_sequential(file_obj):
+    # Tells the kernel that file_obj is read or written from start to end. Does nothing for pyewf / pyvmdk handles and platforms without posix_fadvise.
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(file_obj.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except (AttributeError, OSError, ValueError):
+        pass
+
+
+def get_disk_image_fileno(disk_image):
+    # Returns a file descriptor usable with os.pread(), or None for pyewf / pyvmdk handles and platforms without pread.
+    if not hasattr(os, 'pread'):
+        return None
+    try:
+        return disk_image.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def pread_disk_image(disk_image, disk_image_fd, size, offset):
+    if disk_image_fd is not None:
+        return os.pread(disk_image_fd, size, offset)
+    disk_image.seek(offset)
+    return disk_image.read(size)
+
+
+def read_store_block(disk_image, disk_image_fd, disk_image_view, offset, store_block_view):
+    # Copies the block at offset into store_block_view, straight from the mapped disk image when there is one.
+    if disk_image_view is not None:
+        data = disk_image_view[offset:offset + len(store_block_view)]
+    else:
+        data = pread_disk_image(disk_image, disk_image_fd, len(store_block_view), offset)
+    store_block_view[:len(data)] = data
+    return len(data)
+
+
+def mmap_disk_image(disk_image):
+    # Only RAW images are plain files. pyewf and pyvmdk handles have no file descriptor to map.
+    try:
+        return mmap.mmap(disk_image.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, OverflowError):
+        return None
+
+
+def print_progress(scanned_size, volume_size, end=''):
+    sys.stderr.write('\r' + "Progress: {0} / {1} bytes ({2:.2%}) at {3}".format(scanned_size, volume_size, (scanned_size/volume_size), datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")) + end)
+    sys.stderr.flush()
+
+
+def scan_store_block_header(buf, start_offset, end_offset):
+    # Yields (offset, header) for each 0x4000 block in buf[start_offset:end_offset] that starts with the VSS identifier.
+    # find() searches the whole range in C, so only candidate blocks are handled in python.
+    find = buf.find
+    from_buffer_copy = StoreBlockHeader.from_buffer_copy
+    vssid = vss_identifier
+    block_size = STORE_BLOCK_SIZE
+    search_end_offset = end_offset + len(vssid) - 1
+
+    offset = find(vssid, start_offset, search_end_offset)
+    while offset != -1:
+        misalignment = (offset - start_offset) % block_size
+        if misalignment == 0:
+            yield offset, from_buffer_copy(buf, offset)
+            offset = offset + block_size
+        else:
+            offset = offset + block_size - misalignment
+        offset = find(vssid, offset, search_end_offset)
 
 
-def readinto_ctypes_struct(disk_image, struct_obj):
-    data = disk_image.read(sizeof(struct_obj))
-    return io.BytesIO(data).readinto(struct_obj)
+def read_store_block_header(disk_image, image_offset, volume_size):
+    # Yields (offset, header) for every 0x4000 block of the volume that starts with the VSS identifier.
+    base_offset = image_offset
+    before_time = time.monotonic()
+    disk_image_mmap = mmap_disk_image(disk_image)
+
+    if disk_image_mmap is not None:
+        # The scan reads the volume from start to end. Let the kernel read ahead aggressively (Python 3.8+).
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            disk_image_mmap.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            end_offset = min(base_offset + volume_size, len(disk_image_mmap) - STORE_BLOCK_HEADER_SIZE + 1)
+            for image_offset in range(base_offset, end_offset, CARVE_CHUNK_SIZE):
+                current_time = time.monotonic()
+                if current_time - before_time >= 3:
+                    before_time = current_time
+                    print_progress(image_offset - base_offset, volume_size)
+
+                yield from scan_store_block_header(disk_image_mmap, image_offset, min(image_offset + CARVE_CHUNK_SIZE, end_offset))
+            image_offset = max(end_offset, base_offset)
+        finally:
+            disk_image_mmap.close()
+
+    else:
+        # Read the volume sequentially in large chunks so that the readahead of the disk image library works.
+        end_offset = base_offset + volume_size
+        fadvise_sequential(disk_image)
+        disk_image.seek(image_offset)
+        while image_offset < end_offset:
+            current_time = time.monotonic()
+            if current_time - before_time >= 3:
+                before_time = current_time
+                print_progress(image_offset - base_offset, volume_size)
+
+            chunk = disk_image.read(min(CARVE_CHUNK_SIZE, end_offset - image_offset + STORE_BLOCK_HEADER_SIZE))
+            for offset, store_block_header in scan_store_block_header(chunk, 0, min(len(chunk) - STORE_BLOCK_HEADER_SIZE + 1, end_offset - image_offset)):
+                yield image_offset + offset, store_block_header
+
+            image_offset = image_offset + len(chunk)
+            if len(chunk) < CARVE_CHUNK_SIZE:
+                break
+        image_offset = min(image_offset, end_offset)
+
+    print_progress(image_offset - base_offset, volume_size, '\r\n')
+
 
 def check_vss_enable(disk_image, image_offset):
-    volume_header = VolumeHeader()
+    # The boot sector and the VSS volume header both lie in the first 0x2000 bytes of the volume.
+    volume_head = pread_disk_image(disk_image, get_disk_image_fileno(disk_image), 0x1e00 + sizeof(VolumeHeader), image_offset)
+    if len(volume_head) < 0x1e00 + sizeof(VolumeHeader):
+        exit("Not found VSS volume header.")
 
-    disk_image.seek(image_offset + 0xb)
-    sector_size = struct.unpack("<H", disk_image.read(2))[0]
-    disk_image.seek(image_offset + 0x28)
-    number_of_sector = struct.unpack("<Q", disk_image.read(8))[0]
+    sector_size = struct.unpack_from("<H", volume_head, 0xb)[0]
+    number_of_sector = struct.unpack_from("<Q", volume_head, 0x28)[0]
     volume_size = sector_size * number_of_sector + 0x200
     print("Volume size: {0}".format(hex(volume_size)))
 
-    disk_image.seek(image_offset + 0x1e00)
-    readinto_ctypes_struct(disk_image, volume_header)
+    volume_header = VolumeHeader.from_buffer_copy(volume_head, 0x1e00)
     if volume_header.vssid == vss_identifier:
         print("Found VSS volume header.")
         print("{0}: {1}".format(hex(0x1e00), binascii.b2a_hex(volume_header.vssid)))
@@ -211,51 +403,52 @@ def check_vss_enable(disk_image, image_offset):
         exit("Not found VSS volume header.")
 
 
+def read_catalog_entry0x02(catalog_block, catalog_block_offset, dict_disk_catalog_entry, list_disk_catalog_entry, index_disk_catalog_entry):
+    catalog0x02 = CatalogEntry0x02.from_buffer_copy(catalog_block, catalog_block_offset)
+    guid = struct.unpack("16s", catalog0x02.store_guid)[0]
+    if guid in dict_disk_catalog_entry:
+        dict_disk_catalog_entry[guid] = clone_ctypes_struct(catalog0x02)
+        list_disk_catalog_entry[index_disk_catalog_entry][0] = clone_ctypes_struct(catalog0x02)
+    else:
+        dict_disk_catalog_entry[guid] = ['', '']
+        dict_disk_catalog_entry[guid][0] = clone_ctypes_struct(catalog0x02)
+        list_disk_catalog_entry.append(['', ''])
+        list_disk_catalog_entry[index_disk_catalog_entry][0] = clone_ctypes_struct(catalog0x02)
+    return index_disk_catalog_entry
+
+
+def read_catalog_entry0x03(catalog_block, catalog_block_offset, dict_disk_catalog_entry, list_disk_catalog_entry, index_disk_catalog_entry):
+    catalog0x03 = CatalogEntry0x03.from_buffer_copy(catalog_block, catalog_block_offset)
+    guid = struct.unpack("16s", catalog0x03.store_guid)[0]
+    if guid in dict_disk_catalog_entry:
+        dict_disk_catalog_entry[guid][1] = clone_ctypes_struct(catalog0x03)
+        list_disk_catalog_entry[index_disk_catalog_entry][1] = clone_ctypes_struct(catalog0x03)
+        index_disk_catalog_entry = index_disk_catalog_entry + 1
+    else:
+        dict_disk_catalog_entry[guid] = ['', '']
+        dict_disk_catalog_entry[guid][1] = clone_ctypes_struct(catalog0x03)
+        list_disk_catalog_entry.append(['', ''])
+        list_disk_catalog_entry[index_disk_catalog_entry][0] = clone_ctypes_struct(catalog0x03)
+    return index_disk_catalog_entry
+
+
 def read_catalog_from_disk_image(disk_image, volume_offset, catalog_offset):
-    catalog_block_header = CatalogBlockHeader()
-    catalog0x02 = CatalogEntry0x02()
-    catalog0x03 = CatalogEntry0x03()
     list_disk_catalog_entry = []
     dict_disk_catalog_entry = {}
     index_disk_catalog_entry = 0
+    # Most entries are empty (type 0x0/0x1), so look up the reader once per entry and skip the rest.
+    dict_catalog_entry_reader = {0x2: read_catalog_entry0x02, 0x3: read_catalog_entry0x03}
+    unpack_from = struct.unpack_from
 
     while True:
-        catalog_block_offset = 0
         disk_image.seek(volume_offset + catalog_offset)
-        readinto_ctypes_struct(disk_image, catalog_block_header)
-        catalog_block_offset = catalog_block_offset + 128
-
-        while catalog_block_offset < 0x4000 - 128:
-            catalog_entry_type = struct.unpack("<Q", disk_image.read(8))[0]
-            disk_image.seek(-8, 1)
-
-            if catalog_entry_type == 0x2:
-                readinto_ctypes_struct(disk_image, catalog0x02)
-                guid = struct.unpack("16s", catalog0x02.store_guid)[0]
-                if guid in dict_disk_catalog_entry:
-                    dict_disk_catalog_entry[guid] = copy.deepcopy(catalog0x02)
-                    list_disk_catalog_entry[index_disk_catalog_entry][0] = copy.deepcopy(catalog0x02)
-                else:
-                    dict_disk_catalog_entry[guid] = copy.deepcopy(['', ''])
-                    dict_disk_catalog_entry[guid][0] = copy.deepcopy(catalog0x02)
-                    list_disk_catalog_entry.append(copy.deepcopy(['', '']))
-                    list_disk_catalog_entry[index_disk_catalog_entry][0] = copy.deepcopy(catalog0x02)
-            elif catalog_entry_type == 0x3:
-                readinto_ctypes_struct(disk_image, catalog0x03)
-                guid = struct.unpack("16s", catalog0x03.store_guid)[0]
-                if guid in dict_disk_catalog_entry:
-                    dict_disk_catalog_entry[guid][1] = copy.deepcopy(catalog0x03)
-                    list_disk_catalog_entry[index_disk_catalog_entry][1] = copy.deepcopy(catalog0x03)
-                    index_disk_catalog_entry = index_disk_catalog_entry + 1
-                else:
-                    dict_disk_catalog_entry[guid] = copy.deepcopy(['', ''])
-                    dict_disk_catalog_entry[guid][1] = copy.deepcopy(catalog0x03)
-                    list_disk_catalog_entry.append(copy.deepcopy(['', '']))
-                    list_disk_catalog_entry[index_disk_catalog_entry][0] = copy.deepcopy(catalog0x03)
-            else:
-                disk_image.seek(128, 1)
+        catalog_block = disk_image.read(CATALOG_BLOCK_SIZE)
+        catalog_block_header = CatalogBlockHeader.from_buffer_copy(catalog_block)
 
-            catalog_block_offset = catalog_block_offset + 128
+        for catalog_block_offset in range(CATALOG_ENTRY_SIZE, CATALOG_BLOCK_SIZE - CATALOG_ENTRY_SIZE, CATALOG_ENTRY_SIZE):
+            catalog_entry_reader = dict_catalog_entry_reader.get(unpack_from("<Q", catalog_block, catalog_block_offset)[0])
+            if catalog_entry_reader is not None:
+                index_disk_catalog_entry = catalog_entry_reader(catalog_block, catalog_block_offset, dict_disk_catalog_entry, list_disk_catalog_entry, index_disk_catalog_entry)
 
         catalog_offset = catalog_block_header.next_catalog_offset
         if catalog_offset == 0x0:
@@ -268,27 +461,33 @@ def carve_data_block(disk_image, image_offset, volume_size, debug):
     chunk_head = 0
     chunk_head_record_type = 0
     chunk_continue = 0
-    dict_store_block = {}
+    dict_next_block_offset = {}
     list_store_block_chunk = []
     index_store_block_chunk = 0
-    store_block_header = StoreBlockHeader()
-    base_offset = image_offset
-    before_time = datetime.datetime.now()
+    next_image_offset = image_offset
 
     if debug:
         print("Searching store block chunks.")
 
-    print("Started at {0}".format(before_time.strftime("%Y/%m/%d %H:%M:%S")))
-    while readinto_ctypes_struct(disk_image, store_block_header) and ((image_offset - base_offset) < volume_size):
-        current_time = datetime.datetime.now()
-        if (current_time - before_time).seconds >= 3:
-            before_time = current_time
-            sys.stderr.write('\r' + "Progress: {0} / {1} bytes ({2:.2%}) at {3}".format((image_offset - base_offset), volume_size, ((image_offset - base_offset)/volume_size), datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")))
-            sys.stderr.flush()
+    print("Started at {0}".format(datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")))
+    for image_offset, store_block_header in read_store_block_header(disk_image, image_offset, volume_size):
+        # Blocks between the previous hit and this one are not store blocks.
+        if image_offset != next_image_offset and chunk_continue == 0:
+            chunk_head = 0
+            chunk_head_record_type = 0
+        next_image_offset = image_offset + STORE_BLOCK_SIZE
 
-        if store_block_header.vssid == vss_identifier and store_block_header.version == 1:
+        if store_block_header.version == 1:
             if store_block_header.record_type in [2, 3, 4, 5, 6]:
-                dict_store_block[store_block_header.current_block_offset] = copy.deepcopy(store_block_header)
+                dict_next_block_offset[store_block_header.current_block_offset] = store_block_header.next_block_offset
+
+            if chunk_head != 0 and chunk_head_record_type != store_block_header.record_type:
+                # The chunk is broken off. This block starts a new chunk.
+                if debug:
+                    print("{0}-{1}({2}) : Ver:{3} RType:{4}/{5} Next:{6}  Corrupt Chunk?".format(hex(chunk_head), hex(store_block_header.current_block_offset), hex(store_block_header.current_block_offset - chunk_head + STORE_BLOCK_SIZE), store_block_header.version, chunk_head_record_type, store_block_header.record_type, hex(store_block_header.next_block_offset)))
+                chunk_head = 0
+                chunk_head_record_type = 0
+                chunk_continue = 0
 
             if chunk_head == 0:
                 chunk_head = store_block_header.current_block_offset
@@ -296,45 +495,31 @@ def carve_data_block(disk_image, image_offset, volume_size, debug):
                 list_store_block_chunk.append(StoreBlockChunk(store_block_header))
                 index_store_block_chunk = index_store_block_chunk + 1
 
-            if chunk_head_record_type == store_block_header.record_type:
-                if store_block_header.next_block_offset - store_block_header.current_block_offset > 0x4000 or store_block_header.next_block_offset - store_block_header.current_block_offset < 0x0:
-                    if debug:
-                        print("{0}-{1}({2}) : Ver:{3} RType:{4} Next:{5}".format(hex(chunk_head), hex(store_block_header.current_block_offset), hex(store_block_header.current_block_offset-chunk_head+0x4000), store_block_header.version, store_block_header.record_type, hex(store_block_header.next_block_offset)))
-                    chunk_head = 0
-                    chunk_head_record_type = 0
-                    chunk_continue = 1
-
-                elif store_block_header.next_block_offset == 0:
-                    if debug:
-                        print("{0}-{1}({2}) : Ver:{3} RType:{4} Next:{5}".format(hex(chunk_head), hex(store_block_header.current_block_offset), hex(store_block_header.current_block_offset-chunk_head+0x4000), store_block_header.version, store_block_header.record_type, hex(store_block_header.next_block_offset)))
-                    chunk_head = 0
-                    chunk_head_record_type = 0
-                    chunk_continue = 0
-
-                else:
-                    chunk_continue = 1
+            if store_block_header.next_block_offset - store_block_header.current_block_offset > STORE_BLOCK_SIZE or store_block_header.next_block_offset - store_block_header.current_block_offset < 0x0:
+                if debug:
+                    print("{0}-{1}({2}) : Ver:{3} RType:{4} Next:{5}".format(hex(chunk_head), hex(store_block_header.current_block_offset), hex(store_block_header.current_block_offset-chunk_head+STORE_BLOCK_SIZE), store_block_header.version, store_block_header.record_type, hex(store_block_header.next_block_offset)))
+                chunk_head = 0
+                chunk_head_record_type = 0
+                chunk_continue = 1
 
-            else:
+            elif store_block_header.next_block_offset == 0:
                 if debug:
-                    print("{0}-{1}({2}) : Ver:{3} RType:{4}/{5} Next:{6}  Corrupt Chunk?".format(hex(chunk_head), hex(store_block_header.current_block_offset), hex(store_block_header.current_block_offset - chunk_head + 0x4000), store_block_header.version, chunk_head_record_type, store_block_header.record_type, hex(store_block_header.next_block_offset)))
+                    print("{0}-{1}({2}) : Ver:{3} RType:{4} Next:{5}".format(hex(chunk_head), hex(store_block_header.current_block_offset), hex(store_block_header.current_block_offset-chunk_head+STORE_BLOCK_SIZE), store_block_header.version, store_block_header.record_type, hex(store_block_header.next_block_offset)))
                 chunk_head = 0
                 chunk_head_record_type = 0
                 chunk_continue = 0
-                image_offset = image_offset - 0x4000
+
+            else:
+                chunk_continue = 1
 
         else:
             if chunk_continue == 0:
                 chunk_head = 0
                 chunk_head_record_type = 0
 
-        image_offset = image_offset + 0x4000
-        disk_image.seek(image_offset)
-
-    sys.stderr.write('\r' + "Progress: {0} / {1} bytes ({2:.2%}) at {3}".format((image_offset - base_offset), volume_size, ((image_offset - base_offset)/volume_size), datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")) + '\r\n')
-    sys.stderr.flush()
     print("Finished at {0}".format(datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")))
 
-    return dict_store_block, list_store_block_chunk
+    return dict_next_block_offset, list_store_block_chunk
 
 
 def group_store_block(list_store_block_chunk, debug):
@@ -366,25 +551,25 @@ def group_store_block(list_store_block_chunk, debug):
 
             elif chunk.head.record_type == 6 and index_snapshot_store == 4:
                 dict_snapshot['prev_bitmap'] = chunk
-                list_snapshot_set.append(copy.deepcopy(dict_snapshot))
+                list_snapshot_set.append(dict_snapshot.copy())
                 index_snapshot_store = 0
                 flag_get_snapshot = False
 
         elif chunk.head.record_type == 4 and index_snapshot_store == 4:
             dict_snapshot['prev_bitmap'] = StoreBlockChunk(StoreBlockHeader())
-            list_snapshot_set.append(copy.deepcopy(dict_snapshot))
+            list_snapshot_set.append(dict_snapshot.copy())
             dict_snapshot['header'] = chunk
             index_snapshot_store = 1
             flag_get_snapshot = False
 
         else:
             if flag_get_snapshot:
-                list_snapshot_set.append(copy.deepcopy(dict_snapshot))
+                list_snapshot_set.append(dict_snapshot.copy())
             index_snapshot_store = 0
             flag_get_snapshot = False
 
     if flag_get_snapshot:
-        list_snapshot_set.append(copy.deepcopy(dict_snapshot))
+        list_snapshot_set.append(dict_snapshot.copy())
 
     if debug:
         print("dump list_snapshot_set")
@@ -398,51 +583,51 @@ def group_store_block(list_store_block_chunk, debug):
     return list_snapshot_set
 
 
-def make_list_next_block_offset(dict_store_block, list_next_block_offset, next_block_offset, debug, dict_referred_offset):
+def make_list_next_block_offset(dict_next_block_offset, list_next_block_offset, next_block_offset, debug, dict_referred_offset):
     before_next_block_offset = 0x0
 
-    while True:
-        if next_block_offset in dict_store_block:
-            if debug:
-                if next_block_offset in dict_referred_offset and len(dict_referred_offset[next_block_offset]) > 1:
-                    print("Data block offset: {0} -> Next: {1}".format(hex(before_next_block_offset), hex(next_block_offset)))
-                    print("Offset {0} is referred from multiple data blocks: {1}".format(hex(next_block_offset), [hex(x) for x in dict_referred_offset[next_block_offset]]))
-                elif dict_store_block[next_block_offset].next_block_offset != 0x0:
-                    dict_referred_offset[dict_store_block[next_block_offset].next_block_offset] = []
-
-                if dict_store_block[next_block_offset].next_block_offset != 0x0:
-                    dict_referred_offset[dict_store_block[next_block_offset].next_block_offset].append(next_block_offset)
-
-            if dict_store_block[next_block_offset].next_block_offset in dict_store_block:
-                list_next_block_offset.append(dict_store_block[next_block_offset].next_block_offset)
-            else:
-                list_next_block_offset.append(0x0)
-                return False
-
-            if dict_store_block[next_block_offset].next_block_offset == 0x0:
-                return True
+    while next_block_offset in dict_next_block_offset:
+        following_block_offset = dict_next_block_offset[next_block_offset]
+        if debug:
+            if next_block_offset in dict_referred_offset and len(dict_referred_offset[next_block_offset]) > 1:
+                print("Data block offset: {0} -> Next: {1}".format(hex(before_next_block_offset), hex(next_block_offset)))
+                print("Offset {0} is referred from multiple data blocks: {1}".format(hex(next_block_offset), [hex(x) for x in dict_referred_offset[next_block_offset]]))
+            elif following_block_offset != 0x0:
+                dict_referred_offset[following_block_offset] = []
 
-            before_next_block_offset = next_block_offset
-            next_block_offset = dict_store_block[next_block_offset].next_block_offset
+            if following_block_offset != 0x0:
+                dict_referred_offset[following_block_offset].append(next_block_offset)
 
+        if following_block_offset in dict_next_block_offset:
+            list_next_block_offset.append(following_block_offset)
         else:
-            if debug:
-                print("Next block offset {} was not carved".format(hex(next_block_offset)))
-            list_next_block_offset[-1] = 0x0
+            list_next_block_offset.append(0x0)
             return False
 
+        if following_block_offset == 0x0:
+            return True
+
+        before_next_block_offset = next_block_offset
+        next_block_offset = following_block_offset
 
-def check_store_block_next_block_offset(dict_store_block, list_snapshot_set, debug):
+    if debug:
+        print("Next block offset {} was not carved".format(hex(next_block_offset)))
+    list_next_block_offset[-1] = 0x0
+    return False
+
+
+def check_store_block_next_block_offset(dict_next_block_offset, list_snapshot_set, debug):
     dict_referred_offset = {}
 
     for store in list_snapshot_set:
-        for record_type in store.keys():
-            chunk = store[record_type]
+        for chunk in store.values():
+            list_next_block_offset = chunk.list_next_block_offset
             if chunk.head.next_block_offset != 0x0:
-                result = make_list_next_block_offset(dict_store_block, chunk.list_next_block_offset, chunk.head.next_block_offset, debug, dict_referred_offset)
+                result = make_list_next_block_offset(dict_next_block_offset, list_next_block_offset, chunk.head.next_block_offset, debug, dict_referred_offset)
 
-            if len(chunk.list_next_block_offset) >= 2 and dict_store_block[chunk.list_next_block_offset[-2]].next_block_offset != 0x0:
-                dict_store_block[chunk.list_next_block_offset[-2]].next_block_offset = 0x0
+            # The last-but-one block of the chain is the tail now, so terminate it.
+            if len(list_next_block_offset) >= 2:
+                dict_next_block_offset[list_next_block_offset[-2]] = 0x0
 
     if debug:
         print("dump dict_referred_offset (display offsets that are referred from multiple data blocks only)")
@@ -463,326 +648,148 @@ def check_store_block_next_block_offset(dict_store_block, list_snapshot_set, deb
 
 
 def deduplicate_catalog(dict_disk_catalog_entry, list_snapshot_set):
-    list_remove = []
+    set_store_header_offset = {disk_catalog_entry[1].store_header_offset for disk_catalog_entry in dict_disk_catalog_entry.values() if disk_catalog_entry[1] != ''}
+
+    list_snapshot_set[:] = [snapshot_set for snapshot_set in list_snapshot_set if snapshot_set['header'].head.current_block_offset not in set_store_header_offset]
+
+
+def prefetch_snapshot_set(disk_image_mmap, disk_image_fd, image_offset, snapshot_set):
+    # Asks the kernel to start reading every block of the snapshot in disk order, merging adjacent blocks.
+    # The copy that follows the next_block_offset chains then finds them in the page cache instead of seeking back and forth.
+    if disk_image_mmap is not None:
+        if not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        image_size = len(disk_image_mmap)
+    elif disk_image_fd is None or not hasattr(os, 'posix_fadvise'):
+        return
+
+    list_block_offset = []
+    for chunk in snapshot_set.values():
+        if chunk.head.current_block_offset != 0x0:
+            list_block_offset.append(chunk.head.current_block_offset + image_offset)
+        for next_block_offset in chunk.list_next_block_offset:
+            if next_block_offset == 0x0:
+                break
+            list_block_offset.append(next_block_offset + image_offset)
+    list_block_offset.sort()
+
+    list_range = []
+    for block_offset in list_block_offset:
+        if list_range and block_offset <= list_range[-1][1]:
+            list_range[-1][1] = max(list_range[-1][1], block_offset + STORE_BLOCK_SIZE)
+        else:
+            list_range.append([block_offset, block_offset + STORE_BLOCK_SIZE])
+
+    for start_offset, end_offset in list_range:
+        if disk_image_mmap is not None:
+            # madvise() needs a page aligned start inside the mapping.
+            start_offset = start_offset - start_offset % mmap.PAGESIZE
+            if start_offset < image_size:
+                disk_image_mmap.madvise(mmap.MADV_WILLNEED, start_offset, end_offset - start_offset)
+        else:
+            os.posix_fadvise(disk_image_fd, start_offset, end_offset - start_offset, os.POSIX_FADV_WILLNEED)
 
-    for snapshot_set in list_snapshot_set:
-        for store_guid in dict_disk_catalog_entry.keys():
-            if dict_disk_catalog_entry[store_guid][1].store_header_offset == snapshot_set['header'].head.current_block_offset:
-                list_remove.append(snapshot_set)
 
-    for index in list_remove:
-        list_snapshot_set.remove(index)
+def copy_store_block_chain(disk_image, disk_image_fd, disk_image_view, image_offset, block_offset, f_store, store_file_offset):
+    # Copies the chain of store blocks that starts at block_offset and rewrites their next offsets for the store file (BufferedStoreFile sets the others).
+    # Returns the store file offset that follows the chain.
+    unpack_from_uint64 = UINT64.unpack_from
+    pack_into_uint64 = UINT64.pack_into
+    next_block_offset = block_offset
+    while True:
+        store_block_view = f_store.reserve_store_block()
+        read_store_block(disk_image, disk_image_fd, disk_image_view, next_block_offset + image_offset, store_block_view)
+        next_block_offset = unpack_from_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET)[0]
+        if next_block_offset != 0x0:
+            pack_into_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET, store_file_offset + STORE_BLOCK_SIZE)
+        store_file_offset = store_file_offset + STORE_BLOCK_SIZE
+
+        if next_block_offset == 0x0:
+            return store_file_offset
+
+
+def copy_store_block_chunk(disk_image, disk_image_fd, disk_image_view, image_offset, chunk, get_next_block_offset, f_store, store_file_offset):
+    # Copies a carved chunk (its head block and the chain collected in list_next_block_offset) and rewrites their next offsets for the store file.
+    # Returns the store file offset that follows the chunk.
+    unpack_from_uint64 = UINT64.unpack_from
+    pack_into_uint64 = UINT64.pack_into
+    store_block_view = f_store.reserve_store_block()
+    read_store_block(disk_image, disk_image_fd, disk_image_view, chunk.head.current_block_offset + image_offset, store_block_view)
+    # list_next_block_offset starts with the head's successor, or 0x0 when that block was not carved.
+    # A head without a carved successor is the last block of the chunk, so it must not point at the block written after it.
+    if chunk.list_next_block_offset[0] != 0x0:
+        pack_into_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET, store_file_offset + STORE_BLOCK_SIZE)
+    else:
+        pack_into_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET, 0x0)
+    store_file_offset = store_file_offset + STORE_BLOCK_SIZE
+
+    # The chain ends at the first 0x0, so its length and the store file offset of every block are known up front.
+    list_next_block_offset = chunk.list_next_block_offset
+    if 0x0 in list_next_block_offset:
+        list_next_block_offset = list_next_block_offset[:list_next_block_offset.index(0x0)]
+    chain_end_offset = store_file_offset + len(list_next_block_offset) * STORE_BLOCK_SIZE
+
+    for next_block_offset, following_block_offset, store_file_offset in zip(list_next_block_offset, map(get_next_block_offset, list_next_block_offset), range(store_file_offset, chain_end_offset, STORE_BLOCK_SIZE)):
+        store_block_view = f_store.reserve_store_block()
+        read_store_block(disk_image, disk_image_fd, disk_image_view, next_block_offset + image_offset, store_block_view)
+        # The last block of a chain must not keep an offset that points into the disk image.
+        if following_block_offset != 0 and unpack_from_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET)[0] != 0x0:
+            pack_into_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET, store_file_offset + STORE_BLOCK_SIZE)
+        else:
+            pack_into_uint64(store_block_view, STORE_BLOCK_NEXT_OFFSET, 0x0)
 
+    return chain_end_offset
 
-def write_store(store_file, list_disk_catalog_entry, dict_store_block, list_snapshot_set, disk_image, image_offset):
-    index_store_file = 0
-    index_disk_catalog_entry = 0
 
+def write_store(store_file, list_disk_catalog_entry, dict_next_block_offset, list_snapshot_set, disk_image, image_offset):
     store_file_offset = 0
-    store_block = StoreBlockHeader0x4000()
     catalog0x03 = []
 
-    f_store = open(store_file, "wb")
+    # The chain loops look up the chained next offset of every block they copy.
+    get_next_block_offset = dict_next_block_offset.get
+
+    disk_image_fd = get_disk_image_fileno(disk_image)
+    disk_image_mmap = mmap_disk_image(disk_image)
+    disk_image_view = None
+    if disk_image_mmap is not None:
+        # Keep the default advice. Fault readahead brings in a whole 16 KiB block on the first touch.
+        disk_image_view = memoryview(disk_image_mmap)
+    f_store = BufferedStoreFile(store_file)
 
     #
     # Catalogs from Disk Image
     for disk_catalog_entry in list_disk_catalog_entry:
-        #
-        # Store Header
-        disk_image.seek(disk_catalog_entry[1].store_header_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        next_block_offset = store_block.next_block_offset
-        if next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-            list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-
-        list_disk_catalog_entry[index_disk_catalog_entry][1].store_header_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        while next_block_offset > 0x0:
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            next_block_offset = store_block.next_block_offset
-            if next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-                list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Block List
-        disk_image.seek(disk_catalog_entry[1].store_block_list_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        next_block_offset = store_block.next_block_offset
-        if next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-            # list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-
-        list_disk_catalog_entry[index_disk_catalog_entry][1].store_block_list_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        while next_block_offset > 0x0:
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            next_block_offset = store_block.next_block_offset
-            if next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-                # list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Block Range
-        disk_image.seek(disk_catalog_entry[1].store_block_range_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        next_block_offset = store_block.next_block_offset
-        if next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-            list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-
-        list_disk_catalog_entry[index_disk_catalog_entry][1].store_block_range_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        while next_block_offset > 0x0:
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            next_block_offset = store_block.next_block_offset
-            if next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-                list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Current Bitmap
-        disk_image.seek(disk_catalog_entry[1].store_current_bitmap_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        next_block_offset = store_block.next_block_offset
-        if next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-            list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-
-        list_disk_catalog_entry[index_disk_catalog_entry][1].store_current_bitmap_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        while next_block_offset > 0x0:
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            next_block_offset = store_block.next_block_offset
-            if next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-                list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Previous Bitmap
-        if disk_catalog_entry[1].store_previous_bitmap_offset != 0x0:  # この if 文をカービングしたストアにも入れる
-            disk_image.seek(disk_catalog_entry[1].store_previous_bitmap_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            next_block_offset = store_block.next_block_offset
-            if next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-                list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-
-            list_disk_catalog_entry[index_disk_catalog_entry][1].store_previous_bitmap_offset = store_file_offset
-
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-            while next_block_offset > 0x0:
-                disk_image.seek(next_block_offset + image_offset)
-                readinto_ctypes_struct(disk_image, store_block)
-                store_block.relative_block_offset = store_file_offset
-                store_block.current_block_offset = store_file_offset
-                next_block_offset = store_block.next_block_offset
-                if next_block_offset != 0x0:
-                    store_block.next_block_offset = store_file_offset + 0x4000
-                    list_disk_catalog_entry[index_disk_catalog_entry][1].next_block_offset = store_file_offset + 0x4000
-                f_store.write(store_block)
-                store_file_offset = store_file_offset + 0x4000
+        for store_offset_field in STORE_OFFSET_FIELDS:
+            block_offset = getattr(disk_catalog_entry[1], store_offset_field)
+            if store_offset_field == 'store_previous_bitmap_offset' and block_offset == 0x0:
+                continue
 
-        index_disk_catalog_entry = index_disk_catalog_entry + 1
+            setattr(disk_catalog_entry[1], store_offset_field, store_file_offset)
+            store_file_offset = copy_store_block_chain(disk_image, disk_image_fd, disk_image_view, image_offset, block_offset, f_store, store_file_offset)
 
     #
     # Carved Catalogs
-    for snapshot_set in list_snapshot_set:
-        catalog0x03.append(copy.deepcopy(CatalogEntry0x03()))
-
-        #
-        # Store Header
-        disk_image.seek(snapshot_set['header'].head.current_block_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        if snapshot_set['header'].head.next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-
-        catalog0x03[index_store_file].store_header_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        for next_block_offset in snapshot_set['header'].list_next_block_offset:
-            if next_block_offset == 0x0:
-                break
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            if dict_store_block[next_block_offset].next_block_offset != 0 and store_block.next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Block List
-        disk_image.seek(snapshot_set['block'].head.current_block_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        if snapshot_set['block'].head.next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-
-        catalog0x03[index_store_file].store_block_list_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        if snapshot_set['block'].head.next_block_offset != 0x0:
-            for next_block_offset in snapshot_set['block'].list_next_block_offset:
-                if next_block_offset == 0x0:
-                    break
-                else:
-                    if not dict_store_block[next_block_offset].flag_dummy:
-                        disk_image.seek(next_block_offset + image_offset)
-                        readinto_ctypes_struct(disk_image, store_block)
-                    else:
-                        original_data_block_offset = b'\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF'
-                        relative_store_data_block_offset = b'\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF'
-                        store_data_block_offset = b'\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF'
-                        flags = b'\x00\x00\x00\x00'
-                        allocation_bitmap = b'\x00\x00\x00\x00'
-                        store_block.data = (original_data_block_offset + relative_store_data_block_offset + store_data_block_offset + flags + allocation_bitmap) * ((0x4000-128)//32)
-
-                    store_block.relative_block_offset = store_file_offset
-                    store_block.current_block_offset = store_file_offset
-                    if dict_store_block[next_block_offset].next_block_offset != 0 and store_block.next_block_offset != 0x0:
-                        store_block.next_block_offset = store_file_offset + 0x4000
-                    f_store.write(store_block)
-                    store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Range
-        disk_image.seek(snapshot_set['range'].head.current_block_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        if snapshot_set['range'].head.next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-
-        catalog0x03[index_store_file].store_block_range_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        for next_block_offset in snapshot_set['range'].list_next_block_offset:
-            if next_block_offset == 0x0:
-                break
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            if dict_store_block[next_block_offset].next_block_offset != 0 and store_block.next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Current Bitmap
-        disk_image.seek(snapshot_set['cur_bitmap'].head.current_block_offset + image_offset)
-        readinto_ctypes_struct(disk_image, store_block)
-        store_block.relative_block_offset = store_file_offset
-        store_block.current_block_offset = store_file_offset
-        if snapshot_set['cur_bitmap'].head.next_block_offset != 0x0:
-            store_block.next_block_offset = store_file_offset + 0x4000
-
-        catalog0x03[index_store_file].store_current_bitmap_offset = store_file_offset
-
-        f_store.write(store_block)
-        store_file_offset = store_file_offset + 0x4000
-
-        for next_block_offset in snapshot_set['cur_bitmap'].list_next_block_offset:
-            if next_block_offset == 0x0:
-                break
-            disk_image.seek(next_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            if dict_store_block[next_block_offset].next_block_offset != 0 and store_block.next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-        #
-        # Store Previous Bitmap
-        if snapshot_set['prev_bitmap'].head.current_block_offset != 0x0:
-            disk_image.seek(snapshot_set['prev_bitmap'].head.current_block_offset + image_offset)
-            readinto_ctypes_struct(disk_image, store_block)
-            store_block.relative_block_offset = store_file_offset
-            store_block.current_block_offset = store_file_offset
-            if snapshot_set['prev_bitmap'].head.next_block_offset != 0x0:
-                store_block.next_block_offset = store_file_offset + 0x4000
-
-            catalog0x03[index_store_file].store_previous_bitmap_offset = store_file_offset
-
-            f_store.write(store_block)
-            store_file_offset = store_file_offset + 0x4000
-
-            for next_block_offset in snapshot_set['prev_bitmap'].list_next_block_offset:
-                if next_block_offset == 0x0:
-                    break
-                disk_image.seek(next_block_offset + image_offset)
-                readinto_ctypes_struct(disk_image, store_block)
-                store_block.relative_block_offset = store_file_offset
-                store_block.current_block_offset = store_file_offset
-                # 他の箇所も下の行と同様に直す
-                if dict_store_block[next_block_offset].next_block_offset != 0 and store_block.next_block_offset != 0x0:
-                    store_block.next_block_offset = store_file_offset + 0x4000
-                else:
-                    store_block.next_block_offset = 0x0
-                f_store.write(store_block)
-                store_file_offset = store_file_offset + 0x4000
-
-        index_store_file = index_store_file + 1
+    # Ask for the blocks of the next snapshot before copying the current one, so that the kernel reads them while python copies.
+    if list_snapshot_set:
+        prefetch_snapshot_set(disk_image_mmap, disk_image_fd, image_offset, list_snapshot_set[0])
+    for index_snapshot_set, snapshot_set in enumerate(list_snapshot_set):
+        if index_snapshot_set + 1 < len(list_snapshot_set):
+            prefetch_snapshot_set(disk_image_mmap, disk_image_fd, image_offset, list_snapshot_set[index_snapshot_set + 1])
+        catalog_entry = CatalogEntry0x03()
+        catalog0x03.append(catalog_entry)
+
+        for store_chunk_key, store_offset_field in zip(STORE_CHUNK_KEYS, STORE_OFFSET_FIELDS):
+            chunk = snapshot_set[store_chunk_key]
+            if store_offset_field == 'store_previous_bitmap_offset' and chunk.head.current_block_offset == 0x0:
+                continue
+
+            setattr(catalog_entry, store_offset_field, store_file_offset)
+            store_file_offset = copy_store_block_chunk(disk_image, disk_image_fd, disk_image_view, image_offset, chunk, get_next_block_offset, f_store, store_file_offset)
 
     f_store.close()
+    if disk_image_mmap is not None:
+        disk_image_view.release()
+        disk_image_mmap.close()
     return catalog0x03
 
 
@@ -800,64 +807,59 @@ def write_catalog(catalog_file, list_disk_catalog_entry, list_snapshot_set, cata
         creation_time = list_disk_catalog_entry[-1][0].shadow_copy_creation_time
     else:
         sequence_number = len(catalog0x03)
-        now = datetime.datetime.now()
-        creation_time = epoch_as_filetime + (timegm([now.year, now.month, now.day, now.hour, now.minute, now.second]) * hundreds_of_nanoseconds)
+        creation_time = epoch_as_filetime + int(time.time()) * hundreds_of_nanoseconds
 
     for snapshot_set in list_snapshot_set:
-        guid = uuid.uuid1().bytes
+        guid = uuid.uuid4().bytes
 
         catalog0x02.volume_size = volume_size
         struct.pack_into('%is' % len(guid), catalog0x02.store_guid, 0, guid)
         catalog0x02.sequence_number = sequence_number - index_list_catalog
-        catalog0x02.shadow_copy_creation_time = creation_time - hundreds_of_nanoseconds * 60 * 60 * index_list_catalog
+        catalog0x02.shadow_copy_creation_time = creation_time - FILETIME_PER_HOUR * index_list_catalog
 
         struct.pack_into('%is' % len(guid), catalog0x03[-index_list_catalog].store_guid, 0, guid)
 
-        list_catalog_entry.append(copy.deepcopy((catalog0x02, catalog0x03[-index_list_catalog])))
+        list_catalog_entry.append((clone_ctypes_struct(catalog0x02), clone_ctypes_struct(catalog0x03[-index_list_catalog])))
         index_list_catalog = index_list_catalog + 1
 
     index_list_disk_catalog = 0
     index_list_catalog = 0
-    f_catalog = open(catalog_file, "wb")
-    for catalog_offset in [0x0, 0x4000, 0x8000, 0xc000]:
+    # Empty (type 0x0) entries are all zero, so only the headers and the used entries have to be filled in.
+    catalog = bytearray(CATALOG_BLOCK_SIZE * CATALOG_BLOCK_COUNT)
+    for catalog_offset in range(0x0, CATALOG_BLOCK_SIZE * CATALOG_BLOCK_COUNT, CATALOG_BLOCK_SIZE):
         buf = 0x0
-        if catalog_offset == 0xc000:
+        if catalog_offset == CATALOG_BLOCK_SIZE * (CATALOG_BLOCK_COUNT - 1):
             next_block_offset = 0x0
         else:
-            next_block_offset = catalog_offset + 0x4000
+            next_block_offset = catalog_offset + CATALOG_BLOCK_SIZE
 
         if buf == 0:
-            f_catalog.write(CatalogBlockHeader(catalog_offset, catalog_offset, next_block_offset))
-            buf = buf + 128
+            catalog[catalog_offset:catalog_offset + CATALOG_ENTRY_SIZE] = bytes(CatalogBlockHeader(catalog_offset, catalog_offset, next_block_offset))
+            buf = buf + CATALOG_ENTRY_SIZE
 
+        # Entry pairs are added while more than two entries are left in the block.
         if not flag_disk_catalog_finish and len(list_disk_catalog_entry) > 0:
-            while 0x4000 - buf > 128 * 2 and index_list_disk_catalog < len(list_disk_catalog_entry):
-                f_catalog.write(list_disk_catalog_entry[index_list_disk_catalog][0])
-                f_catalog.write(list_disk_catalog_entry[index_list_disk_catalog][1])
-                buf = buf + 128 * 2
-                index_list_disk_catalog = index_list_disk_catalog + 1
-                if index_list_disk_catalog == len(list_disk_catalog_entry):
-                    flag_disk_catalog_finish = True
-                    break
+            count = min((CATALOG_BLOCK_SIZE - buf - 1) // (CATALOG_ENTRY_SIZE * 2), len(list_disk_catalog_entry) - index_list_disk_catalog)
+            catalog[catalog_offset + buf:catalog_offset + buf + CATALOG_ENTRY_SIZE * 2 * count] = b''.join(bytes(entry[0]) + bytes(entry[1]) for entry in list_disk_catalog_entry[index_list_disk_catalog:index_list_disk_catalog + count])
+            buf = buf + CATALOG_ENTRY_SIZE * 2 * count
+            index_list_disk_catalog = index_list_disk_catalog + count
+            if index_list_disk_catalog == len(list_disk_catalog_entry):
+                flag_disk_catalog_finish = True
         elif len(list_disk_catalog_entry) == 0:
             flag_disk_catalog_finish = True
 
         if flag_disk_catalog_finish and not flag_catalog_finish and len(list_catalog_entry) > 0:
-            while 0x4000 - buf > 128 * 2 and index_list_catalog < len(list_catalog_entry):
-                f_catalog.write(list_catalog_entry[index_list_catalog][0])
-                f_catalog.write(list_catalog_entry[index_list_catalog][1])
-                buf = buf + 128 * 2
-                index_list_catalog = index_list_catalog + 1
-                if index_list_catalog == len(list_catalog_entry):
-                    flag_catalog_finish = True
-                    break
+            count = min((CATALOG_BLOCK_SIZE - buf - 1) // (CATALOG_ENTRY_SIZE * 2), len(list_catalog_entry) - index_list_catalog)
+            catalog[catalog_offset + buf:catalog_offset + buf + CATALOG_ENTRY_SIZE * 2 * count] = b''.join(bytes(entry[0]) + bytes(entry[1]) for entry in list_catalog_entry[index_list_catalog:index_list_catalog + count])
+            buf = buf + CATALOG_ENTRY_SIZE * 2 * count
+            index_list_catalog = index_list_catalog + count
+            if index_list_catalog == len(list_catalog_entry):
+                flag_catalog_finish = True
         elif len(list_catalog_entry) == 0:
             flag_catalog_finish = True
 
-        for i in range((0x4000 - buf) // 128):
-            f_catalog.write(CatalogEntry0x00())
-            buf = buf + 128
-
+    f_catalog = open(catalog_file, "wb")
+    f_catalog.write(catalog)
     f_catalog.close()
 
 
@@ -922,7 +924,7 @@ def main():
 
     print("="*50)
     print("Stage 3: Carving data blocks.")
-    dict_store_block, list_store_block_chunk = carve_data_block(disk_image, args.offset, volume_size, args.debug)
+    dict_next_block_offset, list_store_block_chunk = carve_data_block(disk_image, args.offset, volume_size, args.debug)
 
     print("="*50)
     print("Stage 4: Grouping store blocks by VSS snapshot.")
@@ -930,7 +932,7 @@ def main():
 
     print("="*50)
     print("Stage 5: Checking next block offset lists.")
-    check_store_block_next_block_offset(dict_store_block, list_snapshot_set, args.debug)
+    check_store_block_next_block_offset(dict_next_block_offset, list_snapshot_set, args.debug)
 
     print("="*50)
     print("Stage 6: Deduplicating carved catalog entries.")
@@ -938,7 +940,7 @@ def main():
 
     print("="*50)
     print("Stage 7: Writing store file.")
-    catalog0x03 = write_store(args.store, list_disk_catalog_entry, dict_store_block, list_snapshot_set, disk_image, args.offset)
+    catalog0x03 = write_store(args.store, list_disk_catalog_entry, dict_next_block_offset, list_snapshot_set, disk_image, args.offset)
 
     print("="*50)
     print("Stage 8: Writing catalog file.")